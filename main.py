@@ -3,14 +3,14 @@ from pathlib import Path
 from fastapi import FastAPI, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from starlette.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_limiter import FastAPILimiter
 import redis.asyncio as redis
 from fastapi.staticfiles import StaticFiles
 
-from middlewares import CustomHeaderMiddleware
+from middlewares import CustomHeaderMiddleware, UploadSizeLimitMiddleware
 from src.database.db import get_db
 from src.config.config import config
 from src.routes import comments, auth, users, images, rating
@@ -18,10 +18,12 @@ from src.services.auth import init_blacklist_file
 
 import uvicorn
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 origins = ["*"]
 app.add_middleware(CustomHeaderMiddleware)
+# allow for multipart boundaries and form fields on top of the file itself
+app.add_middleware(UploadSizeLimitMiddleware, path="/api/images/", max_size=images.MAX_UPLOAD_SIZE + 4096)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -48,9 +50,10 @@ async def startup():
     :return: None
     :rtype: None
     """
-    r = await redis.Redis(host=config.REDIS_DOMAIN, port=config.REDIS_PORT, db=0,
-                          password=config.REDIS_PASSWORD, encoding="utf-8",
-                          decode_responses=True)
+    pool = redis.ConnectionPool(host=config.REDIS_DOMAIN, port=config.REDIS_PORT, db=0,
+                                password=config.REDIS_PASSWORD, encoding="utf-8",
+                                decode_responses=True, max_connections=64)
+    r = redis.Redis(connection_pool=pool)
     await FastAPILimiter.init(r)
 
 
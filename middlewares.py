@@ -30,6 +30,29 @@ class CustomHeaderMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class UploadSizeLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Rejects uploads by their Content-Length header before the body is read and parsed.
+    """
+    def __init__(self, app, path: str, max_size: int):
+        super().__init__(app)
+        self.path = path
+        self.max_size = max_size
+
+    async def dispatch(self, request: Request, call_next: Callable):
+        if request.method == "POST" and request.url.path == self.path:
+            content_length = request.headers.get("content-length")
+            if content_length is not None:
+                if not content_length.isdigit():
+                    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                                        content={"detail": "Invalid Content-Length header"})
+                if int(content_length) > self.max_size:
+                    return JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        content={"detail": "File size exceeds 5MB"})
+        response = await call_next(request)
+        return response
+
+
 class BlackListMiddleware(BaseHTTPMiddleware):
     def __init__(self, app):
         super().__init__(app)
@@ -0,0 +1,31 @@
+"""Add image public_id
+
+Revision ID: 3f1c9a7d2b64
+Revises: 78e23b83f83b
+Create Date: 2026-10-14 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, None] = '78e23b83f83b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('public_id', sa.String(length=255), nullable=True))
+    # Recover the Cloudinary public_id of already uploaded images from their delivery URL
+    op.execute(
+        r"UPDATE images SET public_id = regexp_replace(regexp_replace(link, '^.*/upload/(v[0-9]+/)?', ''), "
+        r"'\.[^./]+$', '') WHERE public_id IS NULL"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'public_id')
@@ -0,0 +1,27 @@
+"""Add image updated_at
+
+Revision ID: 9b2e4d7a1c35
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-14 11:03:17.284906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b2e4d7a1c35'
+down_revision: Union[str, None] = '3f1c9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE images SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL")
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'updated_at')
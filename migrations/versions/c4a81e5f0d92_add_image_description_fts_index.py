@@ -0,0 +1,30 @@
+"""Add image description full-text index
+
+Revision ID: c4a81e5f0d92
+Revises: 9b2e4d7a1c35
+Create Date: 2026-10-14 12:21:54.730162
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a81e5f0d92'
+down_revision: Union[str, None] = '9b2e4d7a1c35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_images_description_fts', 'images',
+                    [sa.text("to_tsvector('simple', coalesce(description, ''))")], unique=False,
+                    postgresql_using='gin')
+    op.create_index(op.f('ix_image_tag_tag_id'), 'image_tag', ['tag_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_image_tag_tag_id'), table_name='image_tag')
+    op.drop_index('ix_images_description_fts', table_name='images')
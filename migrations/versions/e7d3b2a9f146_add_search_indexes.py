@@ -0,0 +1,28 @@
+"""Add search indexes on tag lower(name) and rating image_id
+
+Revision ID: e7d3b2a9f146
+Revises: c4a81e5f0d92
+Create Date: 2026-10-14 16:42:08.915372
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7d3b2a9f146'
+down_revision: Union[str, None] = 'c4a81e5f0d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_tags_name_lower', 'tags', [sa.text('lower(name)')], unique=False)
+    op.create_index(op.f('ix_ratings_image_id'), 'ratings', ['image_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_ratings_image_id'), table_name='ratings')
+    op.drop_index('ix_tags_name_lower', table_name='tags')
@@ -1,6 +1,6 @@
 import contextlib
 
-from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 
 from src.config.config import config
@@ -10,7 +10,7 @@ class DataBaseSessionManager:
     def __init__(self, url: str):
         self._engine: AsyncEngine | None = create_async_engine(url)
         self._session_maker: async_sessionmaker = async_sessionmaker(
-            autoflush=False, autocommit=False, bind=self._engine
+            autoflush=False, autocommit=False, expire_on_commit=False, bind=self._engine
         )
 
     @contextlib.asynccontextmanager
@@ -34,3 +34,20 @@ sessionmanager = DataBaseSessionManager(config.DATABASE_URL)
 async def get_db():
     async with sessionmanager.session() as session:
         yield session
+
+
+@contextlib.asynccontextmanager
+async def transaction(session: AsyncSession):
+    """
+    Runs the block in a single transaction: commits on success and rolls back on error.
+    Joins the transaction if the session has already autobegun one (e.g. while loading the current user).
+
+    :param session: The async database session.
+    :type session: AsyncSession
+    """
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    await session.commit()
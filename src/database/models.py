@@ -1,6 +1,7 @@
 import enum
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Boolean, func, Table, Column, Enum
-from sqlalchemy.orm import Mapped, mapped_column, relationship, DeclarativeBase
+from sqlalchemy import (String, Integer, ForeignKey, DateTime, Boolean, func, Table, Column, Enum, Index,
+                        literal_column)
+from sqlalchemy.orm import Mapped, mapped_column, relationship, DeclarativeBase, declared_attr
 from datetime import date
 
 
@@ -10,18 +11,39 @@ class Base(DeclarativeBase):
 
 image_tag = Table('image_tag', Base.metadata,
                   Column('image_id', Integer, ForeignKey('images.id')),
-                  Column('tag_id', Integer, ForeignKey('tags.id'))
+                  Column('tag_id', Integer, ForeignKey('tags.id'), index=True)
                   )
 
 
+def description_tsvector(description):
+    """
+    Full-text search vector of an image description.
+    Used both by ix_images_description_fts and by the search query, so the planner can match the index.
+
+    :param description: The description column.
+    :return: The tsvector expression.
+    """
+    # literals, not bind parameters, so the expression is the same as the indexed one
+    return func.to_tsvector(literal_column("'simple'"), func.coalesce(description, literal_column("''")))
+
+
 class Image(Base):
     __tablename__ = "images"
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (Index('ix_images_description_fts', description_tsvector(cls.description), postgresql_using='gin'),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     link: Mapped[str] = mapped_column(String(150), index=True)
+    public_id: Mapped[str] = mapped_column(String(255), nullable=True)
     description: Mapped[str] = mapped_column(String(250), nullable=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
     tags = relationship("Tag", secondary="image_tag", back_populates="images")
     created_at: Mapped[date] = mapped_column("created_at", DateTime, default=func.now(), nullable=True)
+    updated_at: Mapped[date] = mapped_column(
+        "updated_at", DateTime, default=func.now(), onupdate=func.now(), nullable=True
+    )
     ratings = relationship("Rating", back_populates="image", cascade="all, delete")
     comments = relationship("Comment", back_populates="imagecom", cascade="all, delete")
     user = relationship("User", back_populates="imageuser")
@@ -45,6 +67,11 @@ class Comment(Base):
 
 class Tag(Base):
     __tablename__ = "tags"
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (Index('ix_tags_name_lower', func.lower(cls.name)),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), index=True)
     images = relationship("Image", secondary="image_tag", back_populates="tags")
@@ -81,7 +108,7 @@ class Rating(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
     user: Mapped["User"] = relationship("User", backref="ratings", lazy="joined")
-    image_id: Mapped[int] = mapped_column(Integer, ForeignKey("images.id"), nullable=False)
+    image_id: Mapped[int] = mapped_column(Integer, ForeignKey("images.id"), nullable=False, index=True)
     rating: Mapped[int] = mapped_column(Integer, nullable=False)
     created_at: Mapped[date] = mapped_column(
         "created_at", DateTime, default=func.now(), nullable=False
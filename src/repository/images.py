@@ -1,19 +1,19 @@
+import asyncio
+import functools
 from io import BytesIO
 
 import qrcode
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, literal_column, union
 from sqlalchemy.orm import aliased, selectinload
-from sqlalchemy.sql.expression import or_
-from starlette.responses import StreamingResponse
-from operator import attrgetter
 
-from src.database.models import Image, User, TransformedImage, Tag, SortBy, Rating, Role
-from src.schemas.images import ImageSchema, UpdateDescriptionSchema
+from src.database.models import (Image, User, TransformedImage, Tag, SortBy, Rating, Role, description_tsvector,
+                                 image_tag)
+from src.schemas.images import ImageRow, ImageSchema, UpdateDescriptionSchema
 from src.services.tags import get_tags_list
 
 
-async def create_image(db: AsyncSession, link: str, body: ImageSchema, user: User) -> Image:
+async def create_image(db: AsyncSession, link: str, public_id: str, body: ImageSchema, user: User) -> Image:
     """
     Creates an image owned by current user.
 
@@ -21,6 +21,8 @@ async def create_image(db: AsyncSession, link: str, body: ImageSchema, user: Use
     :type db: AsyncSession
     :param link: Link to image
     :type link: str
+    :param public_id: Cloudinary public ID of the image
+    :type public_id: str
     :param body: The data for the image to create.
     :type body: ImageSchema
     :param user: Current user that creates the image
@@ -28,7 +30,7 @@ async def create_image(db: AsyncSession, link: str, body: ImageSchema, user: Use
     :return: The newly created image.
     :rtype: Image
     """
-    image = Image(link=link, description=body.description, user_id=user.id)
+    image = Image(link=link, public_id=public_id, description=body.description, user_id=user.id)
     tags = await get_tags_list(db, body.tags)
     for tag in tags:
         image.tags.append(tag)
@@ -51,19 +53,13 @@ async def delete_image_db(db: AsyncSession, image_id: int, user: User) -> Image:
     :return: The deleted image, or None if it does not exist.
     :rtype: Image | None
     """
-    query = select(Image).filter_by(id=image_id, user_id=user.id)
+    query = select(Image).filter_by(id=image_id)
+    if user.role != Role.admin:
+        query = query.filter_by(user_id=user.id)
     result = await db.execute(query)
     image = result.scalar_one_or_none()
     if image:
         await db.delete(image)
-        await db.commit()
-    if user.role == Role.admin:
-        query = select(Image).filter_by(id=image_id)
-        result = await db.execute(query)
-        image = result.scalar_one_or_none()
-        if image:
-            await db.delete(image)
-            await db.commit()
     return image
 
 
@@ -87,7 +83,7 @@ async def update_description_db(db: AsyncSession, image_id: int, body: UpdateDes
     image = result.scalar_one_or_none()
     if image:
         image.description = body.description
-        await db.commit()
+        await db.flush()
         await db.refresh(image)
     return image
 
@@ -111,6 +107,58 @@ async def get_image_db(db: AsyncSession, image_id: int, user: User):
     return result_one
 
 
+async def get_image_updated_at(db: AsyncSession, image_id: int, user: User):
+    """
+    Gets the last modification time of an image owned by current user.
+
+    :param db: The async database session.
+    :type db: AsyncSession
+    :param image_id: The ID of the image.
+    :type image_id: int
+    :param user: Current user that gets the image
+    :type user: User
+    :return: The last modification time, or None if the image does not exist.
+    :rtype: datetime | None
+    """
+    query = select(Image.updated_at).filter_by(id=image_id, user_id=user.id)
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def get_image_public_id(db: AsyncSession, image_id: int, user: User):
+    """
+    Gets the Cloudinary public ID of an image owned by current user.
+
+    :param db: The async database session.
+    :type db: AsyncSession
+    :param image_id: The ID of the image.
+    :type image_id: int
+    :param user: Current user that gets the image
+    :type user: User
+    :return: The public ID, or None if the image does not exist.
+    :rtype: str | None
+    """
+    query = select(Image.public_id).filter_by(id=image_id, user_id=user.id)
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def get_images_version_by_user_id(db: AsyncSession, user_id: int):
+    """
+    Gets the latest modification time and the number of images of a user.
+
+    :param db: The async database session.
+    :type db: AsyncSession
+    :param user_id: The ID of the user.
+    :type user_id: int
+    :return: The latest modification time and the number of images.
+    :rtype: tuple[datetime | None, int]
+    """
+    query = select(func.max(Image.updated_at), func.count(Image.id)).filter_by(user_id=user_id)
+    result = await db.execute(query)
+    return result.one()
+
+
 async def save_transformed_image(db: AsyncSession, link: str, image_id: int):
     """
     Saves transformed image.
@@ -126,28 +174,39 @@ async def save_transformed_image(db: AsyncSession, link: str, image_id: int):
     """
     image = TransformedImage(link=link, image_id=image_id)
     db.add(image)
-    await db.commit()
-    await db.refresh(image)
+    await db.flush()
     return image
 
 
-async def generate_qrcode_by_image(image: str):
+@functools.lru_cache(maxsize=1024)
+def _qr_png(link: str) -> bytes:
     """
-    Generates qrcode by image.
+    Renders qrcode for the link as PNG. Results are cached by link.
 
-    :param image: Link to image
-    :type image: str
-    :return: Transformed image
-    :rtype: TransformedImage
+    :param link: Link to image
+    :type link: str
+    :return: PNG image of the qrcode
+    :rtype: bytes
     """
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(image)
+    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=6, border=2)
+    qr.add_data(link)
     qr.make(fit=True)
     img = qr.make_image(fill='black', back_color='white')
     buffer = BytesIO()
     img.save(buffer, "PNG")
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="image/png")
+    return buffer.getvalue()
+
+
+async def generate_qrcode_by_image(link: str) -> bytes:
+    """
+    Generates qrcode by image.
+
+    :param link: Link to image
+    :type link: str
+    :return: PNG image of the qrcode
+    :rtype: bytes
+    """
+    return await asyncio.to_thread(_qr_png, link)
 
 
 async def get_transformed_image_db(db: AsyncSession, image_id: int):
@@ -167,38 +226,58 @@ async def get_transformed_image_db(db: AsyncSession, image_id: int):
     return result_one
 
 
-async def search_images_by_description_or_tag(search_string: str, db: AsyncSession):
+async def search_and_sort(search_string: str, order_by: SortBy, descending: bool, db: AsyncSession,
+                          limit: int = 50):
     """
-    Searches images by description or tag and includes the average rating for each image.
+    Searches images by description or tag and sorts them by rating or date in a single query.
 
     :param search_string: The string to search for.
     :type search_string: str
+    :param order_by: The order to sort by.
+    :type order_by: SortBy
+    :param descending: Whether to sort in descending order.
+    :type descending: bool
     :param db: The async database session.
     :type db: AsyncSession
-    :return: The list of images that match the search string with their average ratings.
+    :param limit: The maximum number of images to return.
+    :type limit: int
+    :return: The sorted list of images that match the search string with their average ratings.
     :rtype: list[dict]
     """
+    # One id select per indexable condition: an OR of both conditions would force a sequential scan of images
+    matching_ids = union(
+        select(Image.id).where(
+            description_tsvector(Image.description).op('@@')(
+                func.plainto_tsquery(literal_column("'simple'"), search_string)
+            )
+        ),
+        select(image_tag.c.image_id).join(Tag, Tag.id == image_tag.c.tag_id).where(
+            func.lower(Tag.name) == search_string.lower()
+        )
+    ).cte("matching_ids")
     ImageAlias = aliased(Image)
     average_rating_subquery = select(
         Rating.image_id,
         func.avg(Rating.rating).label("average_rating")
+    ).where(
+        Rating.image_id.in_(select(matching_ids.c.id))
     ).group_by(
         Rating.image_id
     ).subquery()
+    average_rating = func.coalesce(average_rating_subquery.c.average_rating, 0).label("average_rating")
+    column = average_rating if order_by == SortBy.rating else ImageAlias.created_at
     query = select(
         ImageAlias,
-        average_rating_subquery.c.average_rating
-    ).join(
-        ImageAlias.tags, isouter=True
+        average_rating
     ).join(
         average_rating_subquery,
         ImageAlias.id == average_rating_subquery.c.image_id, isouter=True
     ).where(
-        or_(
-            ImageAlias.description.ilike(f"%{search_string}%"),
-            Tag.name.ilike(f"%{search_string}%")
-        )
-    ).distinct()
+        ImageAlias.id.in_(select(matching_ids.c.id))
+    ).order_by(
+        column.desc() if descending else column.asc(),
+        ImageAlias.id
+    ).limit(limit)
     result = await db.execute(query.options(selectinload(ImageAlias.tags)))
     images_with_ratings = result.all()
     response = []
@@ -211,32 +290,12 @@ async def search_images_by_description_or_tag(search_string: str, db: AsyncSessi
             "description": image.description,
             "tags": ', '.join(tag_names),
             "created_at": image.created_at,
-            "average_rating": average_rating if average_rating is not None else 0
+            "average_rating": average_rating
         })
 
     return response
 
 
-async def sorter(images: list, order_by: SortBy, descending: bool):
-    """
-    Sorts images by rating or date.
-
-    :param images: The list of images to sort.
-    :type images: list
-    :param order_by: The order to sort by.
-    :type order_by: SortBy
-    :param descending: Whether to sort in descending order.
-    :type descending: bool
-    :return: The sorted list of images.
-    :rtype: list
-    """
-    if order_by == SortBy.rating:
-        images.sort(key=lambda x: x.get('average_rating', 0), reverse=descending)
-    elif order_by == SortBy.date:
-        images.sort(key=lambda x: x.get('created_at'), reverse=descending)
-    return images
-
-
 async def get_images_by_user_id(db: AsyncSession, user_id: int):
     """
     Gets images by user id.
@@ -245,9 +304,12 @@ async def get_images_by_user_id(db: AsyncSession, user_id: int):
     :type db: AsyncSession
     :param user_id: The ID of the user.
     :type user_id: int
-    :return: The list of images for the user.
-    :rtype: list[Image]
+    :return: The images of the user, streamed from the database one by one.
+    :rtype: AsyncIterator[ImageRow]
     """
-    query = select(Image).filter_by(user_id=user_id)
-    result = await db.execute(query)
-    return result.scalars().all()
+    query = select(Image.id, Image.link, Image.description, Image.user_id, Image.created_at).filter_by(
+        user_id=user_id
+    )
+    result = await db.stream(query)
+    async for row in result:
+        yield ImageRow(**row._mapping)
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, Depends, UploadFile, File, status, HTTPException, Path
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, UploadFile, File, status, HTTPException, Path, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi_limiter.depends import RateLimiter
+from pydantic import HttpUrl
 from sqlalchemy.ext.asyncio import AsyncSession
+import cloudinary
 import cloudinary.uploader
-import random
+import cloudinary.utils
+from urllib3.util.retry import Retry
+import asyncio
+import msgspec
+import secrets
 
-from src.database.db import get_db
+from src.database.db import get_db, sessionmanager, transaction
 from src.database.models import User, Role, Effect, Crop, SortBy
 from src.repository import images as repository_images
 from src.config.config import config
@@ -18,23 +27,62 @@ cloudinary.config(
     api_secret=config.CLOUDINARY_API_SECRET,
     secure=True
 )
+# The SDK's default connector keeps a single connection per host; share a larger keep-alive pool
+# between the upload threads so concurrent uploads do not redo the TLS handshake.
+cloudinary.uploader._http = cloudinary.utils.get_http_connector(
+    cloudinary.config(), {**cloudinary.CERT_KWARGS, "maxsize": 32, "retries": Retry(total=3, backoff_factor=0.2)}
+)
 
 router = APIRouter(
     prefix="/images",
     tags=["Images"],
 )
 access_to_route_all = RoleAccess([Role.admin])
+access_to_route_admin_mod = RoleAccess([Role.admin, Role.moderator])
+ALLOWED_IMAGE_URL_HOSTS = ["res.cloudinary.com"]
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB in bytes
+
+
+def is_allowed_image_url(url: HttpUrl) -> bool:
+    """
+    Checks that an image URL points to this app's cloud on an allowed Cloudinary host over plain HTTPS.
+
+    :param url: The image URL.
+    :type url: HttpUrl
+    :return: True if Cloudinary may fetch the image from the URL.
+    :rtype: bool
+    """
+    return (url.scheme == "https" and url.host in ALLOWED_IMAGE_URL_HOSTS and url.port == 443
+            and (url.path or "").startswith(f"/{config.CLOUDINARY_NAME}/"))
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED, dependencies=[Depends(RateLimiter(times=1, seconds=10))],
-             description="No more than 5MB file size and 1 request per 10 seconds")
-async def upload_image(file: UploadFile = File(...), body: ImageSchema = Depends(ImageSchema),
-                       db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+def make_etag(updated_at: datetime, key: str) -> str:
+    """
+    Builds a weak ETag from the modification time of a resource.
+
+    :param updated_at: The last modification time.
+    :type updated_at: datetime
+    :param key: The resource identifier.
+    :type key: str
+    :return: The weak ETag.
+    :rtype: str
+    """
+    return f'W/"{int(updated_at.timestamp() * 1_000_000)}-{key}"'
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(RateLimiter(times=1, seconds=10, identifier=auth_service.user_identifier))],
+             description="No more than 5MB file size and 1 request per 10 seconds. "
+                         "Instead of a file, an https image_url of this app's Cloudinary cloud can be given.")
+async def upload_image(file: UploadFile | None = File(None),
+                       body: ImageSchema = Depends(ImageSchema), db: AsyncSession = Depends(get_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
     """
     Uploads an image for the authenticated user.
+    If body contains an image_url, Cloudinary fetches the image from it and no file is needed.
 
     :param file: The image file to upload.
-    :type file: UploadFile
+    :type file: UploadFile | None
     :param body: The data for the new image.
     :type body: ImageSchema
     :param db: The database session.
@@ -44,19 +92,33 @@ async def upload_image(file: UploadFile = File(...), body: ImageSchema = Depends
     :return: The newly created image.
     :rtype: Image
     """
-    max_size = 5 * 1024 * 1024  # 5MB in bytes
-    file_content = await file.read()
-    file_size = len(file_content)
-    if file_size > max_size:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File size exceeds 5MB")
-    public_id = f'PhotoShare/{current_user.email}_{random.randint(1, 1000000)}'
-    result = cloudinary.uploader.upload(file_content, public_id=public_id, overwrite=True)
+    if body.image_url and file is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Provide either a file or an image URL, not both")
+    if body.image_url:
+        if not is_allowed_image_url(body.image_url):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image URL is not allowed")
+        source = str(body.image_url)
+    else:
+        if file is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No file or image URL provided")
+        # bodies with a Content-Length are already rejected by UploadSizeLimitMiddleware; this catches chunked ones
+        if file.size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File size exceeds 5MB")
+        source = file.file
+    public_id = f'PhotoShare/{current_user.email}_{secrets.token_urlsafe(10)}'
+    # The SDK still reads the whole file and builds the request body in memory (uploads are capped at 5MB);
+    # the worker thread only keeps that read and the HTTP call off the event loop.
+    result = await asyncio.to_thread(cloudinary.uploader.upload, source, public_id=public_id, overwrite=False)
+    if result['bytes'] > MAX_UPLOAD_SIZE:  # URL uploads are only measured once Cloudinary has fetched them
+        await asyncio.to_thread(cloudinary.uploader.destroy, result['public_id'])
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File size exceeds 5MB")
     link = result['secure_url']
-    return await repository_images.create_image(db, link, body, current_user)
+    return await repository_images.create_image(db, link, result['public_id'], body, current_user)
 
 
 @router.delete("/{image_id}",
-               dependencies=[Depends(RateLimiter(times=1, seconds=10))],
+               dependencies=[Depends(RateLimiter(times=1, seconds=10, identifier=auth_service.user_identifier))],
                description="No more than 1 request per 10 seconds")
 async def delete_image(image_id: int, db: AsyncSession = Depends(get_db),
                        current_user: User = Depends(auth_service.get_current_user)):
@@ -72,13 +134,15 @@ async def delete_image(image_id: int, db: AsyncSession = Depends(get_db),
     :return: A message indicating that the image was deleted.
     :rtype: dict
     """
-    deleted = await repository_images.delete_image_db(db, image_id, current_user)
+    async with transaction(db):
+        deleted = await repository_images.delete_image_db(db, image_id, current_user)
     if deleted is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     return {"message": "Image deleted"}
 
 
-@router.put("/{image_id}", dependencies=[Depends(RateLimiter(times=1, seconds=10))],
+@router.put("/{image_id}",
+            dependencies=[Depends(RateLimiter(times=1, seconds=10, identifier=auth_service.user_identifier))],
             description="No more than 1 request per 10 seconds")
 async def update_description(image_id: int, body: UpdateDescriptionSchema, db: AsyncSession = Depends(get_db),
                              current_user: User = Depends(auth_service.get_current_user)):
@@ -96,21 +160,28 @@ async def update_description(image_id: int, body: UpdateDescriptionSchema, db: A
     :return: The updated image.
     :rtype: Image
     """
-    description = await repository_images.update_description_db(db, image_id, body, current_user)
+    async with transaction(db):
+        description = await repository_images.update_description_db(db, image_id, body, current_user)
     if description is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     return description
 
 
-@router.get("/{image_id}", dependencies=[Depends(RateLimiter(times=2, seconds=10))],
+@router.get("/{image_id}",
+            dependencies=[Depends(RateLimiter(times=2, seconds=10, identifier=auth_service.user_identifier))],
             description="No more than 2 requests per 10 seconds")
-async def get_image(image_id: int, db: AsyncSession = Depends(get_db),
+async def get_image(image_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     Retrieves the image with the given ID for the authenticated user.
+    Returns 304 Not Modified if the client already has the current version.
 
     :param image_id: The ID of the image to retrieve.
     :type image_id: int
+    :param request: The incoming request.
+    :type request: Request
+    :param response: The outgoing response.
+    :type response: Response
     :param db: The async database session.
     :type db: AsyncSession
     :param current_user: The currently authenticated user.
@@ -118,13 +189,20 @@ async def get_image(image_id: int, db: AsyncSession = Depends(get_db),
     :return: The retrieved image.
     :rtype: Image
     """
+    updated_at = await repository_images.get_image_updated_at(db, image_id, current_user)
+    etag = make_etag(updated_at, str(image_id)) if updated_at else None
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     image = await repository_images.get_image_db(db, image_id, current_user)
     if image is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    if etag:
+        response.headers["ETag"] = etag
     return image
 
 
-@router.post("/{image_id}/crop", dependencies=[Depends(RateLimiter(times=2, seconds=15))],
+@router.post("/{image_id}/crop",
+             dependencies=[Depends(RateLimiter(times=2, seconds=15, identifier=auth_service.user_identifier))],
              description="No more than 2 requests per 15 seconds")
 async def crop_image(image_id: int, size: UpdateImageSchema, crop: Crop, db: AsyncSession = Depends(get_db),
                      current_user: User = Depends(auth_service.get_current_user)):
@@ -144,19 +222,19 @@ async def crop_image(image_id: int, size: UpdateImageSchema, crop: Crop, db: Asy
     :return: The cropped image.
     :rtype: Image
     """
-    image = await repository_images.get_image_db(db, image_id, current_user)
-    if image is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    async with transaction(db):
+        public_id = await repository_images.get_image_public_id(db, image_id, current_user)
+        if public_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
-    public_id = f'PhotoShare(transformed)/{current_user.email}_{random.randint(1, 1000000)}'
-    transformed_image = cloudinary.uploader.upload(image.link, public_id=public_id,
-                                                   transformation={"crop": f"{crop.value}", "width": f"{size.width}",
-                                                                   "height": f"{size.height}"})
-    link = transformed_image['secure_url']
-    return await repository_images.save_transformed_image(db, link, image_id)
+        link = cloudinary.CloudinaryImage(public_id).build_url(crop=crop.value, width=size.width,
+                                                               height=size.height, secure=True)
+        transformed_image = await repository_images.save_transformed_image(db, link, image_id)
+    return transformed_image
 
 
-@router.post("/{image_id}/effect", dependencies=[Depends(RateLimiter(times=2, seconds=15))],
+@router.post("/{image_id}/effect",
+             dependencies=[Depends(RateLimiter(times=2, seconds=15, identifier=auth_service.user_identifier))],
              description="No more than 2 requests per 15 seconds")
 async def use_effect(image_id: int, e: Effect, db: AsyncSession = Depends(get_db),
                      current_user: User = Depends(auth_service.get_current_user)):
@@ -174,17 +252,17 @@ async def use_effect(image_id: int, e: Effect, db: AsyncSession = Depends(get_db
     :return: The transformed image.
     :rtype: Image
     """
-    image = await repository_images.get_image_db(db, image_id, current_user)
-    if image is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-    public_id = f'PhotoShare(transformed)/{current_user.email}_{random.randint(1, 1000000)}'
-    transformed_image = cloudinary.uploader.upload(image.link, public_id=public_id,
-                                                   transformation={"effect": f"art:{e.value}"})
-    link = transformed_image['secure_url']
-    return await repository_images.save_transformed_image(db, link, image_id)
+    async with transaction(db):
+        public_id = await repository_images.get_image_public_id(db, image_id, current_user)
+        if public_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+        link = cloudinary.CloudinaryImage(public_id).build_url(effect=f"art:{e.value}", secure=True)
+        transformed_image = await repository_images.save_transformed_image(db, link, image_id)
+    return transformed_image
 
 
-@router.get("/{image_id}/qrcode", dependencies=[Depends(RateLimiter(times=1, seconds=10))],
+@router.get("/{image_id}/qrcode",
+            dependencies=[Depends(RateLimiter(times=1, seconds=10, identifier=auth_service.user_identifier))],
             description="No more than 1 request per 10 seconds")
 async def generate_qrcode(image_id: int, db: AsyncSession = Depends(get_db),
                           current_user: User = Depends(auth_service.get_current_user)):
@@ -203,10 +281,13 @@ async def generate_qrcode(image_id: int, db: AsyncSession = Depends(get_db),
     image = await repository_images.get_transformed_image_db(db, image_id)
     if image is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-    return await repository_images.generate_qrcode_by_image(image.link)
+    png = await repository_images.generate_qrcode_by_image(image.link)
+    return Response(content=png, media_type="image/png",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 
-@router.get("/search/{image_query}", dependencies=[Depends(RateLimiter(times=2, seconds=15))],
+@router.get("/search/{image_query}",
+            dependencies=[Depends(RateLimiter(times=2, seconds=15, identifier=auth_service.user_identifier))],
             description="No more than 2 requests per 15 seconds")
 async def search_images(order_by: SortBy, descending: bool, image_query: str = Path(..., min_length=2),
                         db: AsyncSession = Depends(get_db),
@@ -227,21 +308,25 @@ async def search_images(order_by: SortBy, descending: bool, image_query: str = P
     :return: The searched images.
     :rtype: List[Image]
     """
-    image_by_description = await repository_images.search_images_by_description_or_tag(image_query, db)
-    if len(image_by_description) == 0:
+    sorted_images = await repository_images.search_and_sort(image_query, order_by, descending, db)
+    if len(sorted_images) == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Images with this query not found")
-    sorted_images = await repository_images.sorter(image_by_description, order_by, descending)
     return sorted_images
 
 
-@router.get("/images/{user_id}", response_model=list[ImageResponse])
-async def get_images_by_user_id(user_id: int, db: AsyncSession = Depends(get_db),
+@router.get("/images/{user_id}", response_model=list[ImageResponse],
+            dependencies=[Depends(access_to_route_admin_mod)])
+async def get_images_by_user_id(user_id: int, request: Request, db: AsyncSession = Depends(get_db),
                                 current_user: User = Depends(auth_service.get_current_user)):
     """
     Gets images by user id. Available for admin and moderator.
+    Returns 304 Not Modified if the client already has the current version,
+    otherwise streams the images as a JSON array.
 
     :param user_id: The id of the user.
     :type user_id: int
+    :param request: The incoming request.
+    :type request: Request
     :param db: The async database session.
     :type db: AsyncSession
     :param current_user: The current user.
@@ -249,7 +334,28 @@ async def get_images_by_user_id(user_id: int, db: AsyncSession = Depends(get_db)
     :return: The list of images.
     :rtype: list[ImageResponse]
     """
-    role_access = RoleAccess([Role.admin, Role.moderator])
-    await role_access(request=None, user=current_user)
-    images = await repository_images.get_images_by_user_id(db, user_id)
-    return images
+    updated_at, count = await repository_images.get_images_version_by_user_id(db, user_id)
+    etag = make_etag(updated_at, f"{user_id}-{count}") if updated_at else None
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return StreamingResponse(_stream_images_by_user_id(user_id), media_type="application/json",
+                             headers={"ETag": etag} if etag else None)
+
+
+async def _stream_images_by_user_id(user_id: int):
+    """
+    Streams images of the user as a JSON array, one image per chunk.
+    Uses its own session, since the request session is closed before the response body is sent.
+
+    :param user_id: The id of the user.
+    :type user_id: int
+    :return: Chunks of the JSON array.
+    :rtype: AsyncIterator[bytes]
+    """
+    yield b"["
+    separator = b""
+    async with sessionmanager.session() as db:
+        async for image in repository_images.get_images_by_user_id(db, user_id):
+            yield separator + msgspec.json.encode(image)
+            separator = b","
+    yield b"]"
@@ -1,18 +1,30 @@
-from typing import List
-from pydantic import BaseModel, Field
+from typing import List, Optional
+import msgspec
+from pydantic import BaseModel, Field, HttpUrl
 from datetime import datetime
 
 
 class ImageResponse(BaseModel):
     id: int
     link: str
-    description: str
+    description: str | None
     user_id: int
-    created_at: datetime
+    created_at: datetime | None
+
+
+# Same fields as ImageResponse; used internally and encoded straight to JSON without Pydantic
+class ImageRow(msgspec.Struct):
+    id: int
+    link: str
+    description: str | None
+    user_id: int
+    created_at: datetime | None
+
 
 class ImageSchema(BaseModel):
     description: str = Field(max_length=250)
     tags: List[str] = Field(max_items=5)
+    image_url: Optional[HttpUrl] = None
 
 
 class UpdateDescriptionSchema(BaseModel):
@@ -1,14 +1,12 @@
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from src.schemas.users import UserResponse
 
 
 class RatingSchema(BaseModel):
     image_id: int
     rating: int
-
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class RatingResponse(BaseModel):
@@ -17,14 +15,10 @@ class RatingResponse(BaseModel):
     user: UserResponse
     rating: int
     created_at: datetime | None
-
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class RatingAverageResponse(BaseModel):
     image_id: int
     average_rating: float | None
-
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
@@ -3,8 +3,10 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import redis
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
+from fastapi_limiter import default_identifier
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -159,6 +161,26 @@ class Auth:
             user = pickle.loads(user)  # noqa
         return user
 
+    async def user_identifier(self, request: Request):
+        """
+        Rate limiter identifier that keys requests by user instead of client IP.
+        Falls back to the client IP for requests without a valid access token.
+
+        :param request: incoming request
+        :type request: Request
+        :return: rate limit key
+        :rtype: str
+        """
+        scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+        if scheme.lower() == "bearer" and token:
+            try:
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+                if payload.get('scope') == 'access_token' and payload.get('sub'):
+                    return f"{payload['sub']}:{request.scope['path']}"
+            except JWTError:
+                pass
+        return await default_identifier(request)
+
     def create_email_token(self, data: dict):
         """
         Create email token for verification email